@@ -13,6 +13,11 @@ QR_DIRECTORY.mkdir(parents=True, exist_ok=True)  # Ensure directory exists
 FILL_COLOR = os.getenv('FILL_COLOR', 'red')
 BACK_COLOR = os.getenv('BACK_COLOR', 'white')
 
+# Maximum number of blocking file/QR operations running in worker threads at once
+MAX_BLOCKING_WORKERS = int(os.getenv('MAX_BLOCKING_WORKERS', 32))
+# Maximum number of QR codes rendered at once, bounding image buffer memory (default: CPU count)
+MAX_CONCURRENT_GENERATIONS = int(os.getenv('MAX_CONCURRENT_GENERATIONS', os.cpu_count() or 4))
+
 # Server configuration
 SERVER_BASE_URL = os.getenv('SERVER_BASE_URL', 'http://localhost:8000')
 SERVER_DOWNLOAD_FOLDER = os.getenv('SERVER_DOWNLOAD_FOLDER', 'downloads')
@@ -1,48 +1,133 @@
-from fastapi import APIRouter, HTTPException, Depends, Response, status
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, HTTPException, Depends, Header, Response, status
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer
-from typing import List
+from pathlib import Path
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+import asyncio
+import os
+import stat
+import anyio
+import orjson
 from app.schema import QRCodeRequest, QRCodeResponse
-from app.services.qr_service import generate_qr_code, list_qr_codes, delete_qr_code
-from app.utils.common import decode_filename_to_url, encode_url_to_filename, generate_links
-from app.config import QR_DIRECTORY, SERVER_BASE_URL, FILL_COLOR, BACK_COLOR, SERVER_DOWNLOAD_FOLDER
+from app.services.qr_service import try_create_qr, iter_qr_code_batches, delete_qr_code
+from app.utils.common import accepts_media_type, decode_filename_to_url, encode_url_to_filename, generate_links
+from app.config import QR_DIRECTORY, SERVER_BASE_URL, FILL_COLOR, BACK_COLOR, SERVER_DOWNLOAD_FOLDER, MAX_BLOCKING_WORKERS, MAX_CONCURRENT_GENERATIONS
 import logging
 
 # Set up router and authentication
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Caps how many blocking operations (file IO and QR rendering) are handed to worker threads at the same time;
+# all filesystem calls in this router go through run_blocking so the cap covers them
+blocking_semaphore = asyncio.BoundedSemaphore(MAX_BLOCKING_WORKERS)
+# Caps how many QR codes are rendered concurrently, since each render holds its image in memory
+generation_semaphore = asyncio.BoundedSemaphore(MAX_CONCURRENT_GENERATIONS)
+
+async def run_blocking(func, *args):
+    """
+    Runs a blocking function in a worker thread so the event loop stays responsive.
+    """
+    async with blocking_semaphore:
+        return await anyio.to_thread.run_sync(func, *args)
+
+# Renders in progress in this process, keyed by QR filename. Duplicate requests wait for the first render
+# instead of repeating it; the atomic link in generate_qr_code still guards against other workers.
+in_flight_renders: Dict[str, asyncio.Future] = {}
+
+async def render_qr_code_once(request: QRCodeRequest, qr_code_full_path: Path) -> Tuple[Optional[bytes], bool]:
+    """
+    Renders the QR code unless it is already stored, sharing one render between concurrent requests for it.
+    Returns the PNG bytes (None if the file already existed) and whether this request created the file.
+    """
+    qr_filename = qr_code_full_path.name
+    while (pending := in_flight_renders.get(qr_filename)) is not None:
+        try:
+            return await asyncio.shield(pending), False
+        except asyncio.CancelledError:
+            if not pending.cancelled():
+                raise  # This request itself was cancelled
+            # The rendering request was cancelled; look again and render here if nobody else has
+
+    render = asyncio.get_running_loop().create_future()
+    # Mark a failed render as retrieved even when no other request was waiting for it
+    render.add_done_callback(lambda done: done.cancelled() or done.exception())
+    in_flight_renders[qr_filename] = render
+    try:
+        async with generation_semaphore:
+            png_bytes = await run_blocking(
+                try_create_qr, request.url, qr_code_full_path, FILL_COLOR, BACK_COLOR, request.size
+            )
+    except asyncio.CancelledError:
+        render.cancel()
+        raise
+    except Exception as e:
+        render.set_exception(e)
+        raise
+    else:
+        render.set_result(png_bytes)
+    finally:
+        del in_flight_renders[qr_filename]
+    return png_bytes, png_bytes is not None
+
+def qr_code_exists_response(qr_code_download_url: str, links: List[dict]) -> JSONResponse:
+    """
+    Builds the 200 response returned when the requested QR code is already stored.
+    """
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={
+            "message": "QR code already exists.",
+            "qr_code_url": qr_code_download_url,
+            "links": links,
+        }
+    )
+
 # Endpoint to create a QR code
-@router.post("/qr-codes/", response_model=QRCodeResponse, status_code=status.HTTP_201_CREATED, tags=["QR Codes"])
-async def create_qr_code(request: QRCodeRequest, token: str = Depends(oauth2_scheme)):
+@router.post("/qr-codes/", response_model=QRCodeResponse, status_code=status.HTTP_201_CREATED, tags=["QR Codes"],
+             responses={200: {"content": {"image/png": {}}}, 201: {"content": {"image/png": {}}}})
+async def create_qr_code(request: QRCodeRequest, token: str = Depends(oauth2_scheme),
+                         accept: Optional[str] = Header(default=None)):
     """
     Creates a QR code for a given URL and stores it in the configured directory.
+    Clients sending "Accept: image/png" receive the PNG itself instead of the JSON description.
     """
     logging.info(f"Creating QR code for URL: {request.url}")
-    
+
     # Encode the URL to a filename-safe base64 string
     encoded_url = encode_url_to_filename(request.url)
     qr_filename = f"{encoded_url}.png"
     qr_code_full_path = QR_DIRECTORY / qr_filename
+
+    # Check if QR code already exists; existing codes skip the render queue
+    png_bytes = None
+    existed = await run_blocking(os.path.exists, qr_code_full_path)
+    if not existed:
+        png_bytes, created = await render_qr_code_once(request, qr_code_full_path)
+        existed = not created
+
+    # Serve the image directly, reusing the freshly rendered bytes so the client needs no download request
+    if accepts_media_type(accept, "image/png"):
+        # Requests that rendered the file or waited on another render already have its bytes
+        while png_bytes is None:
+            try:
+                png_bytes = await run_blocking(qr_code_full_path.read_bytes)
+            except FileNotFoundError:
+                # Deleted since the existence check; render it again rather than making the client retry
+                logging.warning(f"QR code deleted while being read, rendering it again: {qr_code_full_path}")
+                png_bytes, created = await render_qr_code_once(request, qr_code_full_path)
+                existed = not created
+        return Response(content=png_bytes, media_type="image/png",
+                        status_code=status.HTTP_200_OK if existed else status.HTTP_201_CREATED)
+
     qr_code_download_url = f"{SERVER_BASE_URL}/{SERVER_DOWNLOAD_FOLDER}/{qr_filename}"
-    
+
     # Generate HATEOAS links
     links = generate_links("create", qr_filename, SERVER_BASE_URL, qr_code_download_url)
 
-    # Check if QR code already exists
-    if qr_code_full_path.exists():
+    if existed:
         logging.info(f"QR code already exists: {qr_code_full_path}")
-        return JSONResponse(
-            status_code=status.HTTP_200_OK,
-            content={
-                "message": "QR code already exists.",
-                "qr_code_url": qr_code_download_url,
-                "links": links,
-            }
-        )
-
-    # Generate the QR code
-    generate_qr_code(request.url, qr_code_full_path, FILL_COLOR, BACK_COLOR, request.size)
+        return qr_code_exists_response(qr_code_download_url, links)
     logging.info(f"QR code created: {qr_code_full_path}")
 
     # Return success response
@@ -52,30 +137,67 @@ async def create_qr_code(request: QRCodeRequest, token: str = Depends(oauth2_sch
         links=links
     )
 
+def encode_listing_batch(qr_files: List[str], download_prefix: str) -> bytes:
+    """
+    Encodes a batch of QR code filenames as comma-separated JSON listing items.
+    Filenames that don't decode to a URL are logged and skipped, whichever batch they fall in.
+    """
+    items = []
+    for qr_file in qr_files:
+        try:
+            qr_code_url = decode_filename_to_url(qr_file[:-4])  # Decode filename to URL
+        except ValueError:
+            logging.warning(f"Skipping QR code with an undecodable filename: {qr_file}")
+            continue
+        items.append(orjson.dumps({
+            "message": "QR code available",
+            "qr_code_url": qr_code_url,
+            "links": generate_links("list", qr_file, SERVER_BASE_URL, download_prefix + qr_file),
+        }))
+    return b",".join(items)
+
+async def stream_qr_code_listing(first_items: bytes, batches: Iterator[List[str]],
+                                 download_prefix: str) -> AsyncIterator[bytes]:
+    """
+    Streams the QR code listing as a JSON array, one batch of scanned filenames at a time.
+    """
+    try:
+        yield b"[" + first_items
+        wrote_items = bool(first_items)
+        while (qr_files := await run_blocking(next, batches, None)) is not None:
+            items = encode_listing_batch(qr_files, download_prefix)
+            if items:
+                yield (b"," if wrote_items else b"") + items
+                wrote_items = True
+    finally:
+        batches.close()
+    yield b"]"
+
 # Endpoint to list all QR codes
 @router.get("/qr-codes/", response_model=List[QRCodeResponse], tags=["QR Codes"])
 async def list_qr_codes_endpoint(token: str = Depends(oauth2_scheme)):
     """
     Lists all available QR codes in the configured directory.
+    The directory is scanned in batches and streamed, so memory use does not grow with its size.
     """
     logging.info("Listing all QR codes.")
 
-    # Get list of QR code files
-    qr_files = list_qr_codes(QR_DIRECTORY)
-    if not qr_files:
-        logging.warning("No QR codes found.")
-        return []
-
-    # Generate responses for each QR code
-    responses = [
-        QRCodeResponse(
-            message="QR code available",
-            qr_code_url=decode_filename_to_url(qr_file[:-4]),  # Decode filename to URL
-            links=generate_links("list", qr_file, SERVER_BASE_URL, f"{SERVER_BASE_URL}/{SERVER_DOWNLOAD_FOLDER}/{qr_file}")
-        )
-        for qr_file in qr_files
-    ]
-    return responses
+    # Scan the first batch up front so directory errors still produce an error status
+    batches = iter_qr_code_batches(QR_DIRECTORY)
+    try:
+        first_batch = await run_blocking(next, batches, None)
+        if first_batch is None:
+            logging.warning("No QR codes found.")
+            return []
+        # Build the shared download URL prefix only once
+        download_prefix = f"{SERVER_BASE_URL}/{SERVER_DOWNLOAD_FOLDER}/"
+        first_items = encode_listing_batch(first_batch, download_prefix)
+    except BaseException:
+        batches.close()
+        raise
+
+    return StreamingResponse(stream_qr_code_listing(first_items, batches, download_prefix),
+                             media_type="application/json")
 
 # Endpoint to delete a QR code
 @router.delete("/qr-codes/{qr_filename}", status_code=status.HTTP_204_NO_CONTENT, tags=["QR Codes"])
@@ -87,15 +209,19 @@ async def delete_qr_code_endpoint(qr_filename: str, token: str = Depends(oauth2_
     qr_code_path = QR_DIRECTORY / qr_filename
 
     # Check if file exists
-    if not qr_code_path.is_file():
+    try:
+        is_file = stat.S_ISREG((await run_blocking(os.stat, qr_code_path)).st_mode)
+    except FileNotFoundError:
+        is_file = False
+    if is_file:
+        # Delete the QR code file; it can still vanish after the check if deleted concurrently
+        is_file = await run_blocking(delete_qr_code, qr_filename, QR_DIRECTORY)
+    if not is_file:
         logging.warning(f"QR code not found: {qr_filename}")
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="QR code not found"
         )
-
-    # Delete the QR code file
-    delete_qr_code(qr_code_path)
     logging.info(f"QR code deleted: {qr_code_path}")
 
     # Return 204 No Content
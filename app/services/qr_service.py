@@ -1,6 +1,8 @@
+import io
 import os
-from typing import List
-import qrcode
+import tempfile
+from typing import Iterator, List, Optional
+import segno
 import logging
 from pathlib import Path
 from app.config import SERVER_BASE_URL, SERVER_DOWNLOAD_FOLDER
@@ -15,8 +17,11 @@ def list_qr_codes(directory_path: Path) -> List[str]:
     - A list of filenames (str) for QR codes found in the directory.
     """
     try:
-        # List all files ending with '.png' in the specified directory.
-        return [f for f in os.listdir(directory_path) if f.endswith('.png')]
+        # List all regular files ending with '.png' in the specified directory.
+        # scandir's DirEntry caches the file type, so is_file() needs no extra stat call.
+        with os.scandir(directory_path) as entries:
+            return [entry.name for entry in entries
+                    if entry.name.endswith('.png') and entry.is_file(follow_symlinks=False)]
     except FileNotFoundError:
         logging.error(f"Directory not found: {directory_path}")
         raise
@@ -24,42 +29,117 @@ def list_qr_codes(directory_path: Path) -> List[str]:
         logging.error(f"An OS error occurred while listing QR codes: {e}")
         raise
 
-def generate_qr_code(data: str, path: Path, fill_color: str = 'red', back_color: str = 'white', size: int = 10):
+def iter_qr_code_batches(directory_path: Path, batch_size: int = 500) -> Iterator[List[str]]:
+    """
+    Lazily scans the specified directory and yields QR code filenames in batches.
+    Parameters:
+    - directory_path (Path): The filesystem path to the directory containing QR code images.
+    - batch_size (int): The maximum number of filenames per batch.
+
+    Returns:
+    - An iterator over lists of at most batch_size filenames (str).
+    """
+    try:
+        with os.scandir(directory_path) as entries:
+            batch = []
+            for entry in entries:
+                if entry.name.endswith('.png') and entry.is_file(follow_symlinks=False):
+                    batch.append(entry.name)
+                    if len(batch) == batch_size:
+                        yield batch
+                        batch = []
+            if batch:
+                yield batch
+    except FileNotFoundError:
+        logging.error(f"Directory not found: {directory_path}")
+        raise
+    except OSError as e:
+        logging.error(f"An OS error occurred while listing QR codes: {e}")
+        raise
+
+def generate_qr_code(data: str, path: Path, fill_color: str = 'red', back_color: str = 'white', size: int = 10) -> bytes:
     """
     Generates a QR code based on the provided data and saves it to a specified file path.
+    The image is written to a temporary file and hard-linked into place, so the path only ever
+    appears as a complete PNG and concurrent requests for the same path publish it only once.
     Parameters:
     - data (str): The data to encode in the QR code.
     - path (Path): The filesystem path where the QR code image will be saved.
     - fill_color (str): Color of the QR code.
     - back_color (str): Background color of the QR code.
     - size (int): The size of each box in the QR code grid.
+
+    Returns:
+    - The PNG bytes written to the file, so callers can serve them without reading the file back.
+
+    Raises:
+    - FileExistsError: If a QR code already exists at the path.
     """
     logging.debug("QR code generation started")
     try:
-        qr = qrcode.QRCode(version=1, box_size=size, border=5)
-        qr.add_data(data)
-        qr.make(fit=True)
-        img = qr.make_image(fill_color=fill_color, back_color=back_color)
-        img.save(str(path))
-        logging.info(f"QR code successfully saved to {path}")
+        # segno picks the smallest fitting version and writes the PNG itself, without Pillow
+        qr = segno.make(data, error='m', micro=False, boost_error=False)
+        buffer = io.BytesIO()
+        qr.save(buffer, kind='png', scale=size, border=5, dark=fill_color, light=back_color)
+        png_bytes = buffer.getvalue()
+
+        # The '.tmp' suffix keeps the partial file out of QR code listings
+        fd, temp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as stream:
+                stream.write(png_bytes)
+            os.chmod(temp_path, 0o644)
+            os.link(temp_path, path)  # Fails atomically if the name already exists
+        finally:
+            os.remove(temp_path)
+    except FileExistsError:
+        logging.info(f"QR code already exists at {path}")
+        raise
     except Exception as e:
         logging.error(f"Failed to generate/save QR code: {e}")
         raise
+    logging.info(f"QR code successfully saved to {path}")
+    return png_bytes
 
-def delete_qr_code(file_name: str, directory: str = "qr_codes") -> bool:
+def try_create_qr(url: str, path: Path, fill_color: str = 'red', back_color: str = 'white',
+                  size: int = 10) -> Optional[bytes]:
+    """
+    Creates the QR code for a URL at the given path unless one is already stored there.
+    The caller validates and encodes the URL into the path; this re-checks existence right before
+    rendering, since a slot may have been awaited meanwhile, and relies on the atomic link for races.
+    Parameters:
+    - url (str): The URL to encode in the QR code.
+    - path (Path): The filesystem path where the QR code image will be saved.
+    - fill_color (str): Color of the QR code.
+    - back_color (str): Background color of the QR code.
+    - size (int): The size of each box in the QR code grid.
+
+    Returns:
+    - The PNG bytes if the QR code was created now, or None if it already existed.
+    """
+    # Files written by other workers are found here without paying for a render
+    if path.exists():
+        return None
+    try:
+        return generate_qr_code(url, path, fill_color, back_color, size)
+    except FileExistsError:
+        # The name is only ever created by a successful link, so it already holds a complete PNG
+        return None
+
+def delete_qr_code(file_name: str, directory: Path) -> bool:
     """
     Deletes a QR code file from the specified directory.
     Args:
         file_name (str): The name of the file to delete.
-        directory (str): The directory containing QR code files. Defaults to 'qr_codes'.
+        directory (Path): The directory containing QR code files.
     Returns:
-        bool: True if the file was successfully deleted, False otherwise.
+        bool: True if the file was successfully deleted, False if it did not exist.
     """
-    file_path = os.path.join(directory, file_name)
-    if os.path.exists(file_path):
-        os.remove(file_path)
+    try:
+        os.remove(directory / file_name)  # Removing directly avoids a race between checking and deleting
         return True
-    return False
+    except FileNotFoundError:
+        return False
 
 def create_directory(directory_path: Path):
     """
@@ -1,31 +1,41 @@
 import logging.config
 import os
 import base64
-from typing import List
-from dotenv import load_dotenv
-from jose import jwt
-from datetime import datetime, timedelta
+import time
+from functools import lru_cache
+from typing import List, Optional
+import jwt
+from datetime import timedelta
 from app.config import ADMIN_PASSWORD, ADMIN_USER, ALGORITHM, SECRET_KEY
 import validators  # Make sure to install this package
 from urllib.parse import urlparse, urlunparse
 
-# Load environment variables from .env file for security and configuration.
-load_dotenv()
+# Environment variables from the .env file are already loaded by app.config.
+
+# Path to 'logging.conf' in the project's root, normalized once for all OS.
+_LOGGING_CONF_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'logging.conf'))
+_logging_configured = False
+
+# The HMAC signing key in bytes, encoded once instead of per token.
+_SECRET_KEY_BYTES = SECRET_KEY.encode('utf-8')
 
 
 def setup_logging():
     """
     Sets up logging for the application using a configuration file.
     This ensures standardized logging across the entire application.
+    Repeated calls are no-ops once logging has been configured.
     """
-    # Construct the path to 'logging.conf', assuming it's in the project's root.
-    logging_config_path = os.path.join(os.path.dirname(__file__), '..', '..', 'logging.conf')
-    normalized_path = os.path.abspath(logging_config_path)  # Normalize the path for all OS
-    if os.path.exists(normalized_path):
-        logging.config.fileConfig(normalized_path, disable_existing_loggers=False)
+    global _logging_configured
+    if _logging_configured:
+        return
+    if os.path.exists(_LOGGING_CONF_PATH):
+        logging.config.fileConfig(_LOGGING_CONF_PATH, disable_existing_loggers=False)
     else:
-        logging.warning(f"Logging configuration file not found at {normalized_path}. Using default logging.")
+        logging.warning(f"Logging configuration file not found at {_LOGGING_CONF_PATH}. Using default logging.")
         logging.basicConfig(level=logging.INFO)
+    # Only mark logging as configured once it succeeded, so a failed attempt can be retried
+    _logging_configured = True
 
 
 def authenticate_user(username: str, password: str):
@@ -58,11 +68,13 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
         str: Encoded JWT token.
     """
     to_encode = data.copy()
-    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=15))
-    to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    # JWT "exp" is a NumericDate (seconds since the epoch), so no datetime objects are needed.
+    expires_seconds = expires_delta.total_seconds() if expires_delta else 15 * 60
+    to_encode["exp"] = int(time.time() + expires_seconds)
+    return jwt.encode(to_encode, _SECRET_KEY_BYTES, algorithm=ALGORITHM)
 
 
+@lru_cache(maxsize=4096)  # The same URLs are submitted repeatedly; invalid ones raise and are not cached
 def validate_and_sanitize_url(url_str: str):
     """
     Validates and sanitizes a URL string.
@@ -92,8 +104,7 @@ def encode_url_to_filename(url: str) -> str:
         str: Base64-encoded string safe for filenames.
     """
     sanitized_url = validate_and_sanitize_url(url)
-    encoded_bytes = base64.urlsafe_b64encode(sanitized_url.encode('utf-8'))
-    return encoded_bytes.decode('utf-8').rstrip('=')
+    return base64.urlsafe_b64encode(sanitized_url.encode('utf-8')).rstrip(b'=').decode('ascii')
 
 
 def decode_filename_to_url(encoded_str: str) -> str:
@@ -106,13 +117,46 @@ def decode_filename_to_url(encoded_str: str) -> str:
     Returns:
         str: Decoded URL.
     """
-    padding_needed = 4 - (len(encoded_str) % 4)
-    if padding_needed:
-        encoded_str += "=" * padding_needed
-    decoded_bytes = base64.urlsafe_b64decode(encoded_str)  # Fix typo
+    padding_needed = -len(encoded_str) & 3  # Restore the '=' padding stripped when encoding
+    decoded_bytes = base64.urlsafe_b64decode(encoded_str + "=" * padding_needed)
     return decoded_bytes.decode('utf-8')
 
 
+def accepts_media_type(accept_header: Optional[str], media_type: str) -> bool:
+    """
+    Checks whether an Accept header explicitly asks for a media type with a non-zero quality.
+
+    Args:
+        accept_header (str, optional): The raw Accept header value.
+        media_type (str): The media type to look for, e.g. "image/png".
+
+    Returns:
+        bool: True if the media type is listed with q > 0, False otherwise.
+    """
+    if not accept_header:
+        return False
+    for media_range in accept_header.split(","):
+        range_type, *params = (part.strip() for part in media_range.split(";"))
+        if range_type.lower() != media_type:
+            continue
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            return True
+    return False
+
+
+# Static parts of the HATEOAS links; generate_links only fills in the href.
+_VIEW_LINK_TEMPLATE = {"rel": "view", "action": "GET", "type": "image/png"}
+_DELETE_LINK_TEMPLATE = {"rel": "delete", "action": "DELETE", "type": "application/json"}
+
+
 def generate_links(action: str, qr_filename: str, base_api_url: str, download_url: str) -> List[dict]:
     """
     Generates HATEOAS links for QR code resources.
@@ -127,10 +171,8 @@ def generate_links(action: str, qr_filename: str, base_api_url: str, download_ur
         List[dict]: List of HATEOAS links.
     """
     links = []
-    if action in ["list", "create"]:
-        original_url = decode_filename_to_url(qr_filename[:-4])
-        links.append({"rel": "view", "href": download_url, "action": "GET", "type": "image/png"})
-    if action in ["list", "create", "delete"]:
-        delete_url = f"{base_api_url}/qr-codes/{qr_filename}"
-        links.append({"rel": "delete", "href": delete_url, "action": "DELETE", "type": "application/json"})
+    if action in ("list", "create"):
+        links.append({**_VIEW_LINK_TEMPLATE, "href": download_url})
+    if action in ("list", "create", "delete"):
+        links.append({**_DELETE_LINK_TEMPLATE, "href": base_api_url + "/qr-codes/" + qr_filename})
     return links
@@ -1,6 +1,14 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
 import pytest
 from httpx import AsyncClient
 from app.main import app  # Import your FastAPI app
+from app.routers import qr_code as qr_code_router
+from app.services import qr_service
+from app.utils import common
+from app.utils.common import accepts_media_type, decode_filename_to_url, encode_url_to_filename
 
 @pytest.mark.asyncio
 async def test_login_for_access_token():
@@ -54,4 +62,190 @@ async def test_create_and_delete_qr_code():
             qr_code_url = create_response.json()["qr_code_url"]
             qr_filename = qr_code_url.split('/')[-1]
             delete_response = await ac.delete(f"/qr-codes/{qr_filename}", headers=headers)
-            assert delete_response.status_code == 204  # No Content, successfully deleted
\ No newline at end of file
+            assert delete_response.status_code == 204  # No Content, successfully deleted
+
+@pytest.mark.parametrize("url", ["https://example.com", "https://example.com/a", "https://example.com/ab"])
+def test_filename_encoding_round_trip(url):
+    encoded = encode_url_to_filename(url)
+    assert "=" not in encoded
+    assert decode_filename_to_url(encoded) == url
+
+def test_failed_render_leaves_no_file(tmp_path, monkeypatch):
+    def failing_make(*args, **kwargs):
+        raise RuntimeError("render failed")
+    monkeypatch.setattr(qr_service.segno, "make", failing_make)
+    with pytest.raises(RuntimeError):
+        qr_service.try_create_qr("https://example.com/broken", tmp_path / "broken.png")
+    assert list(tmp_path.iterdir()) == []
+
+@pytest.mark.parametrize("accept, expected", [
+    (None, False),
+    ("application/json", False),
+    ("image/png", True),
+    ("application/json, image/png;q=0.5", True),
+    ("image/png;q=0", False),
+    ("image/png; q=0.0, application/json", False),
+])
+def test_accepts_media_type(accept, expected):
+    assert accepts_media_type(accept, "image/png") is expected
+
+@pytest.mark.asyncio
+async def test_create_qr_code_returns_png_when_accepted(tmp_path, monkeypatch):
+    monkeypatch.setattr(qr_code_router, "QR_DIRECTORY", tmp_path)
+    request = SimpleNamespace(url="https://example.com/png", size=5)
+
+    created = await qr_code_router.create_qr_code(request, "token", "image/png")
+    assert created.status_code == 201
+    assert created.media_type == "image/png"
+    assert created.body.startswith(b"\x89PNG")
+    [stored] = tmp_path.iterdir()
+    assert stored.read_bytes() == created.body
+
+    existing = await qr_code_router.create_qr_code(request, "token", "image/png")
+    assert existing.status_code == 200
+    assert existing.body == created.body
+
+@pytest.mark.asyncio
+async def test_create_qr_code_returns_json_when_png_refused(tmp_path, monkeypatch):
+    monkeypatch.setattr(qr_code_router, "QR_DIRECTORY", tmp_path)
+    request = SimpleNamespace(url="https://example.com/json", size=5)
+    qr_service.try_create_qr(request.url, tmp_path / f"{encode_url_to_filename(request.url)}.png")
+
+    response = await qr_code_router.create_qr_code(request, "token", "image/png;q=0, application/json")
+    assert response.status_code == 200
+    assert response.media_type == "application/json"
+    assert json.loads(response.body)["message"] == "QR code already exists."
+
+async def _list_qr_codes(ac):
+    token_response = await ac.post("/token", data={"username": "admin", "password": "secret"})
+    headers = {"Authorization": f"Bearer {token_response.json()['access_token']}"}
+    return await ac.get("/qr-codes/", headers=headers)
+
+@pytest.mark.asyncio
+async def test_list_qr_codes_streams_all_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(qr_code_router, "QR_DIRECTORY", tmp_path)
+    monkeypatch.setattr(qr_code_router, "iter_qr_code_batches",
+                        lambda directory_path: qr_service.iter_qr_code_batches(directory_path, batch_size=2))
+    urls = {f"https://example.com/{i}" for i in range(5)}
+    for url in urls:
+        (tmp_path / f"{encode_url_to_filename(url)}.png").touch()
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await _list_qr_codes(ac)
+    assert response.status_code == 200
+    listing = json.loads(response.content)  # Must be a complete, valid JSON array
+    assert {item["qr_code_url"] for item in listing} == urls
+    assert all(len(item["links"]) == 2 for item in listing)
+
+@pytest.mark.asyncio
+async def test_list_qr_codes_empty_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(qr_code_router, "QR_DIRECTORY", tmp_path)
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await _list_qr_codes(ac)
+    assert response.status_code == 200
+    assert response.json() == []
+
+def test_encode_listing_batch_skips_undecodable_filenames():
+    good = f"{encode_url_to_filename('https://example.com')}.png"
+    items = qr_code_router.encode_listing_batch([good, "bad!!.png"], "http://test/downloads/")
+    assert [item["qr_code_url"] for item in json.loads(b"[" + items + b"]")] == ["https://example.com"]
+
+@pytest.mark.asyncio
+async def test_delete_qr_code_removed_concurrently(tmp_path, monkeypatch):
+    monkeypatch.setattr(qr_code_router, "QR_DIRECTORY", tmp_path)
+    (tmp_path / "gone.png").touch()
+
+    def delete_after_concurrent_removal(file_name, directory):
+        (directory / file_name).unlink()  # Another request deletes it between the check and the removal
+        return qr_service.delete_qr_code(file_name, directory)
+    monkeypatch.setattr(qr_code_router, "delete_qr_code", delete_after_concurrent_removal)
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        token_response = await ac.post("/token", data={"username": "admin", "password": "secret"})
+        headers = {"Authorization": f"Bearer {token_response.json()['access_token']}"}
+        response = await ac.delete("/qr-codes/gone.png", headers=headers)
+    assert response.status_code == 404
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("batch_size", [1, 500])
+async def test_list_qr_codes_skips_undecodable_files_in_any_batch(tmp_path, monkeypatch, batch_size):
+    monkeypatch.setattr(qr_code_router, "QR_DIRECTORY", tmp_path)
+    monkeypatch.setattr(qr_code_router, "iter_qr_code_batches",
+                        lambda directory_path: qr_service.iter_qr_code_batches(directory_path, batch_size=batch_size))
+    urls = {f"https://example.com/{i}" for i in range(3)}
+    for url in urls:
+        (tmp_path / f"{encode_url_to_filename(url)}.png").touch()
+    (tmp_path / "bad!!.png").touch()
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await _list_qr_codes(ac)
+    assert response.status_code == 200
+    assert {item["qr_code_url"] for item in json.loads(response.content)} == urls
+
+def test_setup_logging_retries_after_failed_config(tmp_path, monkeypatch):
+    broken_conf = tmp_path / "logging.conf"
+    broken_conf.write_text("[loggers]\nkeys=root\n")  # Missing the sections fileConfig requires
+    monkeypatch.setattr(common, "_logging_configured", False)
+    monkeypatch.setattr(common, "_LOGGING_CONF_PATH", str(broken_conf))
+    with pytest.raises(KeyError):
+        common.setup_logging()
+    assert common._logging_configured is False
+
+    monkeypatch.setattr(common, "_LOGGING_CONF_PATH", str(tmp_path / "missing.conf"))
+    common.setup_logging()
+    assert common._logging_configured is True
+
+@pytest.mark.asyncio
+async def test_create_qr_code_renders_again_after_external_delete(tmp_path, monkeypatch):
+    monkeypatch.setattr(qr_code_router, "QR_DIRECTORY", tmp_path)
+    request = SimpleNamespace(url="https://example.com/deleted", size=5)
+
+    first = await qr_code_router.create_qr_code(request, "token", "image/png")
+    assert first.status_code == 201
+    for stored in tmp_path.iterdir():
+        stored.unlink()  # Deleted by another worker or by hand
+
+    again = await qr_code_router.create_qr_code(request, "token", "image/png")
+    assert again.status_code == 201
+    assert again.body.startswith(b"\x89PNG")
+    assert len(list(tmp_path.iterdir())) == 1
+
+@pytest.mark.asyncio
+async def test_concurrent_creates_share_one_render(tmp_path, monkeypatch):
+    monkeypatch.setattr(qr_code_router, "QR_DIRECTORY", tmp_path)
+    real_make = qr_service.segno.make
+    calls = []
+
+    def slow_make(*args, **kwargs):
+        calls.append(args)
+        time.sleep(0.1)  # Keep the first render in flight while the second request arrives
+        return real_make(*args, **kwargs)
+    monkeypatch.setattr(qr_service.segno, "make", slow_make)
+
+    request = SimpleNamespace(url="https://example.com/concurrent", size=5)
+    responses = await asyncio.gather(
+        qr_code_router.create_qr_code(request, "token", "image/png"),
+        qr_code_router.create_qr_code(request, "token", "image/png"),
+    )
+    assert len(calls) == 1
+    assert sorted(response.status_code for response in responses) == [200, 201]
+    assert responses[0].body == responses[1].body
+    assert qr_code_router.in_flight_renders == {}
+
+@pytest.mark.asyncio
+async def test_create_qr_code_renders_again_if_deleted_before_read(tmp_path, monkeypatch):
+    monkeypatch.setattr(qr_code_router, "QR_DIRECTORY", tmp_path)
+    request = SimpleNamespace(url="https://example.com/vanishing", size=5)
+    path = tmp_path / f"{encode_url_to_filename(request.url)}.png"
+    qr_service.try_create_qr(request.url, path)
+
+    real_read_bytes = qr_code_router.Path.read_bytes
+    def read_after_concurrent_delete(self):
+        self.unlink(missing_ok=True)  # Another request deletes it between the existence check and the read
+        monkeypatch.setattr(qr_code_router.Path, "read_bytes", real_read_bytes)
+        return real_read_bytes(self)
+    monkeypatch.setattr(qr_code_router.Path, "read_bytes", read_after_concurrent_delete)
+
+    response = await qr_code_router.create_qr_code(request, "token", "image/png")
+    assert response.status_code == 201
+    assert response.body == path.read_bytes()